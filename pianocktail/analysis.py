@@ -0,0 +1,227 @@
+import logging
+import os
+import typing
+from dataclasses import dataclass, field
+from functools import partial
+
+import torch
+
+from pianocktail.audio.audio_clip import AudioClip
+from pianocktail.audio.compact_spectogram import COMPACT_TYPES, CompactSpectogram
+from pianocktail.audio.multi_resolution import MultiResolutionAnalyzer
+from pianocktail.config import Config
+from pianocktail.dataset.audio_catalog import clip_from_catalog, mark_analyzed
+from pianocktail.dataset.models.audio_file import AudioFile
+from pianocktail.utils.prefetch import PrefetchStats, Prefetcher
+
+# Number of windows of a file read and analysed in a single tensor pass.
+BATCH_WINDOWS = 16
+
+# Errors of a single file, which do not stop the analysis of the others.
+FILE_ERRORS = (ValueError, RuntimeError, OSError)
+
+# Start of a window and its peaks, as returned by ``AudioClip.audible_peaks_batch``.
+WindowPeaks = tuple[float, list[dict[torch.Tensor, torch.Tensor]]]
+
+
+def peaks_path(config: Config, path: str) -> str:
+    return os.path.join(config.peaks_location, f"{path}.pt")
+
+
+def save_peaks(config: Config, path: str, peaks: list[WindowPeaks]) -> None:
+    """Write the peaks of the audible windows of a catalog file, replacing the previous ones."""
+    target = peaks_path(config, path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    torch.save(peaks, f"{target}.tmp")
+    os.replace(f"{target}.tmp", target)
+
+
+def load_peaks(config: Config, path: str) -> list[WindowPeaks]:
+    return torch.load(peaks_path(config, path))  # type: ignore
+
+
+@dataclass(frozen=True)
+class WindowChunk:
+    entry: AudioFile
+    clip: AudioClip
+    starts: list[float]
+
+
+@dataclass(frozen=True)
+class CompactChunk:
+    """Spectograms of the audible windows of a chunk, None when they are all silent."""
+
+    starts: list[float]
+    spectograms: typing.Optional[CompactSpectogram]
+
+
+@dataclass
+class BatchReport:
+    files: int = 0
+    windows: int = 0
+    skipped: int = 0
+    failed: int = 0
+    pipeline: typing.Optional[PrefetchStats] = None
+
+    def __str__(self) -> str:
+        report = f"{self.files} files, {self.windows} windows, {self.skipped} silent windows skipped, {self.failed} files failed"
+        return f"{report}, pipeline: {self.pipeline}" if self.pipeline is not None else report
+
+
+@dataclass
+class _FileProgress:
+    remaining_chunks: int
+    windows: int = 0
+    peaks: list[WindowPeaks] = field(default_factory=list)
+
+
+class BatchAnalysis:
+    """Peaks of every window of catalog entries, by chunks of ``BATCH_WINDOWS`` windows.
+
+    The peaks of the audible windows of a file are saved with ``save_peaks`` once all
+    its chunks are analysed, and only then is the file marked as analysed. A file that
+    fails, for instance because it changed since the scan, is logged and skipped: it
+    stays pending and the next run analyses it again.
+
+    In pipelined mode, the chunks are read and decoded by ``config.pipeline.workers``
+    threads, at most ``config.pipeline.queue_depth`` chunks ahead of the analysis.
+
+    With ``compact`` ("uint8" or "float16"), the spectograms are computed when the chunk
+    is loaded and kept as CompactSpectogram until the peak search, so that the queued
+    chunks take a quarter (uint8) or half (float16) of the memory of their samples.
+    The quantization may move a peak to a neighbouring bin when two bins are within its
+    error; with ``check_compact`` every compact spectogram is checked against its float32
+    one with ``CompactSpectogram.check_error``.
+    """
+
+    logger = logging.getLogger("pianocktail.analysis.BatchAnalysis")
+
+    def __init__(
+        self,
+        config: Config,
+        device: torch.device,
+        multi_resolution: bool = False,
+        compact: typing.Optional[str] = None,
+        check_compact: bool = False,
+    ) -> None:
+        self.config = config
+        self._device = device
+        self.multi_resolution = multi_resolution
+        if compact is not None and compact not in COMPACT_TYPES:
+            self.logger.error("Unknown compact spectogram type %s", compact)
+            raise ValueError(f"Unknown compact spectogram type: {compact}, expected one of {', '.join(COMPACT_TYPES)}")
+        if compact is not None and multi_resolution:
+            self.logger.error("Compact spectograms are not available with the multi-resolution analysis")
+            raise ValueError("Compact spectograms are not available with the multi-resolution analysis")
+        if check_compact and compact is None:
+            self.logger.error("The compact spectogram check needs a compact spectogram type")
+            raise ValueError("The compact spectogram check needs a compact spectogram type")
+        self.compact = COMPACT_TYPES[compact] if compact is not None else None
+        self.check_compact = check_compact
+        self._analyzers: dict[int, MultiResolutionAnalyzer] = {}
+
+    def _load(self, chunk: WindowChunk) -> typing.Union[torch.Tensor, CompactChunk]:
+        """The samples of a chunk, or the compact spectograms of its audible windows."""
+        samples = chunk.clip.samples_batch(chunk.starts)
+        if self.compact is None:
+            return samples
+        starts, spectograms = chunk.clip.audible_spectograms(chunk.starts, samples)
+        if not starts:
+            return CompactChunk(starts, None)
+        compact = CompactSpectogram.encode(spectograms, self.compact)
+        if self.check_compact:
+            # Raise ValueError, which fails the file, if a bin is off by more than the quantization bound.
+            error = compact.check_error(spectograms)
+            self.logger.debug("%s: compact spectogram error %fdB, bound %fdB", chunk.entry.path, error, compact.error_bound)
+        return CompactChunk(starts, compact)
+
+    def _try_load(self, chunk: WindowChunk) -> typing.Union[torch.Tensor, CompactChunk, Exception]:
+        # The error is handed to the analysis loop, so that a failing file does not stop the prefetching.
+        try:
+            return self._load(chunk)
+        except FILE_ERRORS as e:
+            return e
+
+    def _analyse(self, chunk: WindowChunk, loaded: typing.Union[torch.Tensor, CompactChunk]) -> list[WindowPeaks]:
+        """Peaks of the audible windows of a chunk."""
+        if isinstance(loaded, CompactChunk):
+            if loaded.spectograms is None:
+                return []
+            return list(zip(loaded.starts, loaded.spectograms.peaks_batch(self.config.sampling)))
+        samples = loaded
+        if not self.multi_resolution:
+            return chunk.clip.audible_samples_peaks(chunk.starts, samples)
+        analyzer = self._analyzers.setdefault(chunk.entry.id, MultiResolutionAnalyzer(chunk.clip))
+        audible = chunk.clip.audible_mask(samples).tolist()
+        return [(start, analyzer.waveform_peaks(waveform[0])) for start, waveform, is_audible in zip(chunk.starts, samples, audible) if is_audible]
+
+    def _chunks(self, entries: typing.Iterable[AudioFile], progress: dict[int, _FileProgress], report: BatchReport) -> list[WindowChunk]:
+        chunks: list[WindowChunk] = []
+        for entry in entries:
+            clip = clip_from_catalog(entry, self.config, self._device)
+            starts = clip.window_starts()
+            entry_chunks = [WindowChunk(entry, clip, starts[i : i + BATCH_WINDOWS]) for i in range(0, len(starts), BATCH_WINDOWS)]
+            progress[entry.id] = _FileProgress(len(entry_chunks))
+            if not entry_chunks:
+                # Too short for a single window, there is nothing to analyse.
+                self._finish(entry, progress[entry.id], report)
+            chunks.extend(entry_chunks)
+        return chunks
+
+    def _done(self, chunk: WindowChunk, peaks: list[WindowPeaks], progress: _FileProgress, report: BatchReport) -> None:
+        progress.remaining_chunks -= 1
+        progress.windows += len(chunk.starts)
+        progress.peaks.extend(peaks)
+        if progress.remaining_chunks <= 0:
+            self._finish(chunk.entry, progress, report)
+
+    def _finish(self, entry: AudioFile, progress: _FileProgress, report: BatchReport) -> None:
+        # In pipelined mode, the chunks of a file may complete out of order.
+        save_peaks(self.config, entry.path, sorted(progress.peaks, key=lambda window: window[0]))
+        mark_analyzed(entry)
+        self._analyzers.pop(entry.id, None)
+        analysed = len(progress.peaks)
+        report.files += 1
+        report.windows += progress.windows
+        report.skipped += progress.windows - analysed
+        self.logger.info("%s: %d windows analysed, %d silent windows skipped", entry.path, analysed, progress.windows - analysed)
+
+    def _process(
+        self,
+        chunk: WindowChunk,
+        loaded: typing.Union[torch.Tensor, CompactChunk, Exception],
+        progress: dict[int, _FileProgress],
+        report: BatchReport,
+    ) -> None:
+        if chunk.entry.id not in progress:
+            # An earlier chunk of the file failed.
+            return
+        try:
+            if isinstance(loaded, Exception):
+                raise loaded
+            self._done(chunk, self._analyse(chunk, loaded), progress[chunk.entry.id], report)
+        except FILE_ERRORS as e:
+            self.logger.error("%s: analysis failed, it will be retried by the next run: %s", chunk.entry.path, e)
+            del progress[chunk.entry.id]
+            self._analyzers.pop(chunk.entry.id, None)
+            report.failed += 1
+
+    def run(self, entries: typing.Iterable[AudioFile], pipelined: bool = False) -> BatchReport:
+        report = BatchReport()
+        progress: dict[int, _FileProgress] = {}
+        chunks = self._chunks(entries, progress, report)
+        if pipelined:
+            prefetcher: Prefetcher[WindowChunk, typing.Union[torch.Tensor, CompactChunk, Exception]] = Prefetcher(
+                ((chunk, partial(self._try_load, chunk)) for chunk in chunks),
+                self.config.pipeline.queue_depth,
+                self.config.pipeline.workers,
+            )
+            for chunk, loaded in prefetcher:
+                self._process(chunk, loaded, progress, report)
+            report.pipeline = prefetcher.stats
+        else:
+            for chunk in chunks:
+                self._process(chunk, self._try_load(chunk), progress, report)
+
+        self.logger.info("Batch analysis: %s", report)
+        return report
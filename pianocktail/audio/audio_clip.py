@@ -1,7 +1,7 @@
 import logging
 import typing
 import os
-from functools import cached_property, lru_cache
+from functools import cached_property
 
 import torch
 import torch.nn.functional as ff
@@ -9,21 +9,79 @@ import torchaudio  # type: ignore
 import torchaudio.transforms  # type: ignore
 from matplotlib import pyplot
 
-from pianocktail.config import Config
+from pianocktail.config import Config, SamplingConfig
+
+KERNEL_DILATION = torch.Tensor([[[[1], [2], [1]]]])
+KERNEL_EROSION = torch.Tensor([[[[1], [0], [1]]]])
+# Frequency rows on each side of a band that reach it through the erosion and dilation kernels.
+FILTER_MARGIN = 2
+# Energy of a digital silence, avoids log10(0).
+ENERGY_FLOOR = 1e-12
+
+
+def frame_rms_db(waveform: torch.Tensor, frame_length: int) -> torch.Tensor:
+    """RMS level in dBFS of the consecutive frames of the last axis, an incomplete last frame is ignored."""
+    n_frames = max(1, waveform.shape[-1] // frame_length)
+    frames = waveform[..., : n_frames * frame_length].reshape(*waveform.shape[:-1], n_frames, -1)
+    return 10 * torch.log10(frames.pow(2).mean(dim=-1).clamp(min=ENERGY_FLOOR))
+
+
+def _correlate_frequency(spectogram: torch.Tensor, kernel: torch.Tensor) -> torch.Tensor:
+    # Same as a "same" padded conv2d with a (3, 1) kernel, but as shifted sums that stay
+    # fast on batches, where conv2d with such a thin kernel does not.
+    padded = ff.pad(spectogram, (0, 0, 1, 1))
+    n_bins = spectogram.shape[-2]
+    return sum(weight * padded[..., i : i + n_bins, :] for i, weight in enumerate(kernel.flatten().tolist()) if weight)  # type: ignore
+
+
+def filter_spectogram(spectogram: torch.Tensor) -> torch.Tensor:
+    """Erode then dilate (..., frequency, time) spectograms along the frequency axis."""
+    return _correlate_frequency(_correlate_frequency(spectogram, KERNEL_EROSION), KERNEL_DILATION)
+
+
+def frequency_bins(sampling: SamplingConfig) -> list[int]:
+    return [int(f // sampling.frequency_resolution) for f in sampling.frequency_range]
+
+
+def band_peaks_batch(spectograms: torch.Tensor, sampling: SamplingConfig) -> list[list[dict[torch.Tensor, torch.Tensor]]]:
+    """``band_peaks`` of a (batch, frequency, time) tensor, with one max reduction per band for the whole batch."""
+    bins = frequency_bins(sampling)
+    peaks: list[list[typing.Any]] = [[{} for _ in range(spectograms.shape[2])] for _ in range(spectograms.shape[0])]
+    for i in range(0, len(bins) - 1):
+        result = torch.max(spectograms[:, bins[i] : bins[i + 1], :], dim=1)
+        frequencies = (bins[i] + result.indices) * sampling.frequency_resolution
+        for window_peaks, window_frequencies, window_values in zip(peaks, frequencies, result.values):
+            for frame_peaks, frequency, value in zip(window_peaks, window_frequencies, window_values):
+                frame_peaks[frequency] = value
+    return peaks
+
+
+def band_peaks(spectogram: torch.Tensor, sampling: SamplingConfig) -> list[dict[torch.Tensor, torch.Tensor]]:
+    """For each time frame, the frequency and value of the maximum of each band of the frequency range."""
+    return band_peaks_batch(spectogram.unsqueeze(0), sampling)[0]
 
 
 class AudioClip:
     logger = logging.getLogger("audio.audio_clip.AudioClip")
-    kernel_dilation = torch.Tensor([[[[1], [2], [1]]]])
-    kernel_erosion = torch.Tensor([[[[1], [0], [1]]]])
+    kernel_dilation = KERNEL_DILATION
+    kernel_erosion = KERNEL_EROSION
 
-    def __init__(self, name: str, config: Config, device: torch.device) -> None:
+    def __init__(
+        self,
+        name: str,
+        config: Config,
+        device: torch.device,
+        metadata: typing.Optional[torchaudio.AudioMetaData] = None,
+    ) -> None:
         self.logger = self.__class__.logger.getChild(f"[{name}]")
         self.config = config
         self._device = device
         self._name = name
         self._path = os.path.join(self.config.audio_location, name)
-        if not os.path.isfile(self._path):
+        if metadata is not None:
+            # Metadata coming from the audio catalog, the file is known to exist.
+            self.metadata = metadata
+        elif not os.path.isfile(self._path):
             raise ValueError(f"{self._path} is not a file")
 
     @cached_property
@@ -37,6 +95,11 @@ class AudioClip:
     def _sample_duration_in_frame(self) -> int:
         return self._time_to_frame(self.config.sampling.duration)
 
+    def window_starts(self) -> list[float]:
+        """Start times of the consecutive, non overlapping windows covering the clip."""
+        n_windows = self.metadata.num_frames // self._sample_duration_in_frame
+        return [i * self.config.sampling.duration for i in range(n_windows)]
+
     def sample(self, start: float) -> torch.Tensor:
         start_in_frame = self._time_to_frame(start)
         self.logger.debug(
@@ -53,12 +116,46 @@ class AudioClip:
             frame_offset=start_in_frame,
             num_frames=self._sample_duration_in_frame,
         )
+        if waveform.shape[1] < self._sample_duration_in_frame:
+            self.logger.error("Start duration is too late, cannot extract sample")
+            raise ValueError(f"Start duration is too late: {start}, cannot extract sample")
         waveform.to(self._device)
         if self.metadata.num_channels > 1:
             self.logger.debug("Converting to mono")
             return torch.mean(waveform, dim=0, keepdim=True)
         return waveform  # type: ignore
 
+    def samples_batch(self, starts: typing.Sequence[float]) -> torch.Tensor:
+        """The mono windows starting at each of ``starts``, as a (batch, 1, frames) tensor.
+
+        The range covering all the windows is read at once, so the starts should be close
+        to each other, as the ones of ``window_starts``.
+        """
+        starts_in_frame = [self._time_to_frame(start) for start in starts]
+        for start, start_in_frame in zip(starts, starts_in_frame):
+            if start_in_frame < 0 or start_in_frame + self._sample_duration_in_frame > self.metadata.num_frames:
+                self.logger.error("Start duration is too late, cannot extract sample")
+                raise ValueError(f"Start duration is too late: {start}, cannot extract sample")
+        first_frame = min(starts_in_frame)
+        num_frames = max(starts_in_frame) - first_frame + self._sample_duration_in_frame
+        waveform, _ = torchaudio.load(self._path, frame_offset=first_frame, num_frames=num_frames)
+        if waveform.shape[1] < num_frames:
+            # The file is shorter than its metadata, it changed since it was probed.
+            self.logger.error("Start duration is too late, cannot extract sample")
+            raise ValueError(f"Start duration is too late: {max(starts)}, cannot extract sample")
+        if self.metadata.num_channels > 1:
+            waveform = torch.mean(waveform, dim=0, keepdim=True)
+        offsets = torch.tensor(starts_in_frame) - first_frame
+        indices = offsets.reshape(-1, 1) + torch.arange(self._sample_duration_in_frame)
+        return waveform[0, indices].unsqueeze(1)
+
+    def audible_mask(self, samples: torch.Tensor) -> torch.Tensor:
+        """For each window of a (batch, 1, frames) tensor, whether its loudest hop reaches the silence threshold."""
+        threshold = self.config.sampling.silence_threshold
+        if threshold is None:
+            return torch.ones(samples.shape[0], dtype=torch.bool)
+        return frame_rms_db(samples[:, 0, :], self.hop_length).amax(dim=-1) >= threshold
+
     @cached_property
     def freq_max(self) -> float:
         return self.metadata.sample_rate / 2  # type: ignore
@@ -86,33 +183,52 @@ class AudioClip:
     def spectogram(self, start: float) -> torch.Tensor:
         return self.Spectogram_opj(self.sample(start))[0, :, :]  # type: ignore
 
+    def spectogram_batch(self, starts: typing.Sequence[float]) -> torch.Tensor:
+        """Spectograms of the windows starting at each of ``starts``, as a (batch, frequency, time) tensor."""
+        return self.Spectogram_opj(self.samples_batch(starts))[:, 0, :, :]  # type: ignore
+
     def filtered_spectogram(self, start: float) -> torch.Tensor:
-        spectogram = self.spectogram(start)
-        d_spectogram = ff.conv2d(
-            spectogram.reshape(1, 1, *spectogram.shape),
-            self.kernel_erosion,
-            padding="same",
-        )
-        return ff.conv2d(d_spectogram, self.kernel_dilation, padding="same")[0, 0, :, :]
+        return filter_spectogram(self.spectogram(start))
+
+    def filtered_spectogram_batch(self, starts: typing.Sequence[float]) -> torch.Tensor:
+        return filter_spectogram(self.spectogram_batch(starts))
 
     def _frequency_to_bin(self, frequency: float) -> int:
         return int(frequency // self.config.sampling.frequency_resolution)
 
-    @lru_cache  # noqa: B019
-    def _bin_to_frequency(self, bin: int) -> float:
-        return bin * self.config.sampling.frequency_resolution
-
     def peaks(self, start: float) -> list[dict[torch.Tensor, torch.Tensor]]:
         spectogram = self.filtered_spectogram(start)
-        bins = [self._frequency_to_bin(f) for f in self.config.sampling.frequency_range]
-        self.logger.debug("Bins: %s", bins)
+        self.logger.debug("Bins: %s", frequency_bins(self.config.sampling))
         self.logger.debug("Spectogram shape: %s", spectogram.shape)
-        peaks: list[typing.Any] = [{} for _ in range(spectogram.shape[1])]
-        for i in range(0, len(bins) - 1):
-            result = torch.max(spectogram[bins[i] : bins[i + 1], :], dim=0)
-            for iter, (indice, value) in enumerate(zip(result.indices, result.values)):
-                peaks[iter][self._bin_to_frequency(bins[i] + indice)] = value
-        return peaks
+        return band_peaks(spectogram, self.config.sampling)
+
+    def peaks_batch(self, starts: typing.Sequence[float]) -> list[list[dict[torch.Tensor, torch.Tensor]]]:
+        """``peaks`` of each of ``starts``, with a single read, spectogram, filter and band reduction."""
+        return band_peaks_batch(self.filtered_spectogram_batch(starts), self.config.sampling)
+
+    def audible_peaks_batch(self, starts: typing.Sequence[float]) -> list[tuple[float, list[dict[torch.Tensor, torch.Tensor]]]]:
+        """``(start, peaks)`` of the windows of ``starts`` that are not silent.
+
+        Silent windows are detected on the waveform and skip the spectogram and the filter.
+        """
+        return self.audible_samples_peaks(starts, self.samples_batch(starts))
+
+    def audible_spectograms(self, starts: typing.Sequence[float], samples: torch.Tensor) -> tuple[list[float], torch.Tensor]:
+        """Starts and (batch, frequency, time) spectograms of the windows of ``samples`` that are not silent."""
+        audible = self.audible_mask(samples)
+        audible_starts = [start for start, is_audible in zip(starts, audible.tolist()) if is_audible]
+        if not audible_starts:
+            return [], torch.empty(0, self.n_bins, 0)
+        return audible_starts, self.Spectogram_opj(samples[audible])[:, 0, :, :]
+
+    def audible_samples_peaks(
+        self, starts: typing.Sequence[float], samples: torch.Tensor
+    ) -> list[tuple[float, list[dict[torch.Tensor, torch.Tensor]]]]:
+        """``audible_peaks_batch`` of windows already read by ``samples_batch``."""
+        audible_starts, spectograms = self.audible_spectograms(starts, samples)
+        if not audible_starts:
+            return []
+        return list(zip(audible_starts, band_peaks_batch(filter_spectogram(spectograms), self.config.sampling)))
 
     def plot_waveform(self, waveform: torch.Tensor, prefix: str = "Waveform") -> None:
         t_axis = torch.arange(0, waveform.shape[1]) / self.metadata.sample_rate
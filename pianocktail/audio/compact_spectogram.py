@@ -0,0 +1,104 @@
+import math
+from dataclasses import dataclass
+from functools import cached_property
+
+import torch
+
+from pianocktail.config import SamplingConfig
+
+from .audio_clip import FILTER_MARGIN, band_peaks, band_peaks_batch, filter_spectogram, frequency_bins
+
+# Power of an empty bin, same floor as the plots.
+POWER_FLOOR = 1e-12
+UINT8_LEVELS = 255
+# Types a spectogram can be stored as, by name.
+COMPACT_TYPES = {"uint8": torch.uint8, "float16": torch.float16}
+
+
+@dataclass(frozen=True)
+class CompactSpectogram:
+    """Power spectogram stored as log-magnitude (dB), in float16 or quantized to uint8.
+
+    A uint8 spectogram is ``offset + codes * scale`` dB, where ``offset`` is its maximum
+    minus ``dynamic_range``: quieter bins are clamped to it. It uses a quarter of the
+    memory of the float32 spectogram, float16 half of it.
+
+    The peaks are computed from the rows of the frequency range only, which are the
+    only ones decoded to float, with a lookup table of the 256 levels for uint8. The
+    band maximum cannot run on the codes themselves: the erosion and dilation filter
+    sums neighbouring bins in power, which the dB quantization does not preserve.
+    """
+
+    codes: torch.Tensor
+    scale: float = 1.0
+    offset: float = 0.0
+
+    @classmethod
+    def encode(cls, spectogram: torch.Tensor, dtype: torch.dtype = torch.uint8, dynamic_range: float = 120.0) -> "CompactSpectogram":
+        log_magnitude = 10 * torch.log10(spectogram.clamp(min=POWER_FLOOR))
+        if dtype == torch.float16:
+            return cls(log_magnitude.to(torch.float16))
+        if dtype != torch.uint8:
+            raise ValueError(f"Unsupported compact spectogram type: {dtype}")
+        top = float(log_magnitude.max())
+        bottom = max(float(log_magnitude.min()), top - dynamic_range)
+        scale = (top - bottom) / UINT8_LEVELS or 1.0
+        codes = torch.round((log_magnitude.clamp(min=bottom) - bottom) / scale).to(torch.uint8)
+        return cls(codes, scale, bottom)
+
+    @property
+    def shape(self) -> torch.Size:
+        return self.codes.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.element_size() * self.codes.nelement()
+
+    @property
+    def error_bound(self) -> float:
+        """Largest error, in dB, of a decoded bin above the quantization floor."""
+        if self.codes.dtype == torch.uint8:
+            return self.scale / 2
+        return float(self.codes.abs().max()) * 2**-11
+
+    def log_magnitude(self, rows: slice = slice(None)) -> torch.Tensor:
+        codes = self.codes[..., rows, :]
+        if self.codes.dtype == torch.uint8:
+            return codes.to(torch.float32) * self.scale + self.offset
+        return codes.to(torch.float32)
+
+    @cached_property
+    def _power_levels(self) -> torch.Tensor:
+        return torch.pow(10, (torch.arange(UINT8_LEVELS + 1, dtype=torch.float32) * self.scale + self.offset) / 10)
+
+    def decode(self, rows: slice = slice(None)) -> torch.Tensor:
+        """The power spectogram, or only the given frequency rows of it."""
+        if self.codes.dtype == torch.uint8:
+            return torch.take(self._power_levels, self.codes[..., rows, :].long())
+        return torch.pow(10, self.log_magnitude(rows) / 10)
+
+    def check_error(self, spectogram: torch.Tensor) -> float:
+        """Largest error in dB against the float32 ``spectogram``, raise if it is over ``error_bound``."""
+        reference = 10 * torch.log10(spectogram.clamp(min=POWER_FLOOR))
+        floor = self.offset if self.codes.dtype == torch.uint8 else 10 * math.log10(POWER_FLOOR)
+        decoded = self.log_magnitude()
+        significant = reference > floor
+        error = float((decoded - reference)[significant].abs().max()) if significant.any() else 0.0
+        # Small slack for the float32 rounding of the encoding itself.
+        if error > self.error_bound * (1 + 1e-3) + 1e-4:
+            raise ValueError(f"Compact spectogram error {error}dB is over its bound {self.error_bound}dB")
+        return error
+
+    def _frequency_range_rows(self, sampling: SamplingConfig) -> slice:
+        # The rows under the first band are decoded as well, so that band indices stay absolute.
+        return slice(0, min(self.shape[-2], frequency_bins(sampling)[-1] + FILTER_MARGIN))
+
+    def peaks(self, sampling: SamplingConfig) -> list[dict[torch.Tensor, torch.Tensor]]:
+        """Same as ``band_peaks`` of the filtered decoded spectogram."""
+        return band_peaks(self._filtered(sampling), sampling)
+
+    def peaks_batch(self, sampling: SamplingConfig) -> list[list[dict[torch.Tensor, torch.Tensor]]]:
+        return band_peaks_batch(self._filtered(sampling), sampling)
+
+    def _filtered(self, sampling: SamplingConfig) -> torch.Tensor:
+        return filter_spectogram(self.decode(self._frequency_range_rows(sampling)))
@@ -0,0 +1,166 @@
+import logging
+import threading
+import typing
+from collections import deque
+from dataclasses import dataclass, field
+from time import perf_counter_ns
+
+import torch
+
+from pianocktail.config import Config
+
+from .audio_clip import band_peaks, filter_spectogram, frame_rms_db
+
+PCM_SAMPLE_WIDTH = 2  # signed 16 bits little endian
+PCM_SCALE = 1 << 15
+
+
+class RingBuffer:
+    """Fixed size buffer holding the last ``size`` samples of a mono stream."""
+
+    def __init__(self, size: int) -> None:
+        self._buffer = torch.zeros(size)
+        self._size = size
+        self._position = 0
+
+    def extend(self, samples: torch.Tensor) -> None:
+        samples = samples[-self._size :]
+        end = self._position + samples.shape[0]
+        if end <= self._size:
+            self._buffer[self._position : end] = samples
+        else:
+            split = self._size - self._position
+            self._buffer[self._position :] = samples[:split]
+            self._buffer[: end - self._size] = samples[split:]
+        self._position = end % self._size
+
+    def window(self) -> torch.Tensor:
+        """The buffer content, oldest sample first."""
+        return torch.cat((self._buffer[self._position :], self._buffer[: self._position]))
+
+
+@dataclass
+class LiveStats:
+    frames: int = 0
+    dropped_frames: int = 0
+    silent_frames: int = 0
+    total_latency_ns: int = 0
+    max_latency_ns: int = 0
+    recent_latencies_ns: deque[int] = field(default_factory=lambda: deque(maxlen=1000))
+
+    def add(self, latency_ns: int) -> None:
+        self.frames += 1
+        self.total_latency_ns += latency_ns
+        self.max_latency_ns = max(self.max_latency_ns, latency_ns)
+        self.recent_latencies_ns.append(latency_ns)
+
+    def __str__(self) -> str:
+        if not self.frames:
+            return f"0 frames, {self.dropped_frames} dropped, {self.silent_frames} silent"
+        recent = sorted(self.recent_latencies_ns)
+        p99 = recent[int((len(recent) - 1) * 0.99)]
+        return (
+            f"{self.frames} frames, {self.dropped_frames} dropped, {self.silent_frames} silent, latency mean {self.total_latency_ns / self.frames / 1e6:.2f}ms, "
+            f"p99 {p99 / 1e6:.2f}ms, max {self.max_latency_ns / 1e6:.2f}ms"
+        )
+
+
+class LiveAnalyzer:
+    """Incremental peak extraction from a raw PCM stream.
+
+    The stream is signed 16 bits little endian PCM, channels interleaved. A reader
+    thread cuts it into hops that the analysis loop pushes into a ring buffer of one
+    FFT window. For every hop, only the newest spectogram frame is computed, then
+    filtered and reduced to its band peaks, as ``AudioClip.peaks`` does on a whole
+    window.
+
+    A hop that already waited longer than the latency budget when its turn comes is
+    only pushed to the ring buffer and its frame is dropped. Frames of a window under
+    the silence threshold are skipped before the FFT.
+    """
+
+    logger = logging.getLogger("pianocktail.audio.live.LiveAnalyzer")
+
+    def __init__(self, config: Config, sample_rate: int, channels: int, latency_budget: float, device: torch.device) -> None:
+        self.config = config
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.latency_budget = latency_budget
+        self._device = device
+        n_bins = int(sample_rate / 2 / config.sampling.frequency_resolution)
+        self.n_fft = (n_bins - 1) * 2
+        self.hop_length = self.n_fft // 2
+        self._latency_budget_ns = int(latency_budget * 1e9)
+        self._window = torch.hann_window(self.n_fft, device=device)
+        self._ring = RingBuffer(self.n_fft)
+        self._pending: deque[tuple[torch.Tensor, int]] = deque()
+        self._condition = threading.Condition()
+        self._eof = False
+        self.stats = LiveStats()
+
+    @property
+    def hop_duration(self) -> float:
+        return self.hop_length / self.sample_rate
+
+    def _decode(self, data: typing.Union[bytes, bytearray]) -> torch.Tensor:
+        samples = torch.frombuffer(bytearray(data), dtype=torch.int16).to(torch.float32) / PCM_SCALE
+        return samples.reshape(-1, self.channels).mean(dim=1)
+
+    def _read(self, stream: typing.BinaryIO) -> None:
+        hop_bytes = self.hop_length * self.channels * PCM_SAMPLE_WIDTH
+        buffer = bytearray()
+        try:
+            while data := stream.read(hop_bytes - len(buffer)):
+                buffer.extend(data)
+                if len(buffer) < hop_bytes:
+                    continue
+                hop = self._decode(buffer)
+                buffer.clear()
+                with self._condition:
+                    self._pending.append((hop, perf_counter_ns()))
+                    self._condition.notify()
+        finally:
+            with self._condition:
+                self._eof = True
+                self._condition.notify()
+
+    def _is_silent(self, window: torch.Tensor) -> bool:
+        threshold = self.config.sampling.silence_threshold
+        return threshold is not None and bool(frame_rms_db(window, self.hop_length).max() < threshold)
+
+    def frame_peaks(self, samples: torch.Tensor) -> dict[torch.Tensor, torch.Tensor]:
+        """Band peaks of the spectogram frame of one FFT window."""
+        spectrum = torch.fft.rfft(samples.to(self._device) * self._window).abs().pow(2)
+        return band_peaks(filter_spectogram(spectrum.reshape(-1, 1)), self.config.sampling)[0]
+
+    def run(self, stream: typing.BinaryIO) -> typing.Iterator[tuple[float, dict[torch.Tensor, torch.Tensor]]]:
+        """Yield ``(time, peaks)`` for every analysed hop until the stream ends."""
+        reader = threading.Thread(target=self._read, args=(stream,), daemon=True)
+        reader.start()
+        hop_index = 0
+        while True:
+            with self._condition:
+                while not self._pending and not self._eof:
+                    self._condition.wait()
+                if not self._pending:
+                    break
+                pending = list(self._pending)
+                self._pending.clear()
+
+            for hop, received_ns in pending:
+                # The ring buffer is always fed, so that a dropped frame does not break the following ones.
+                self._ring.extend(hop)
+                hop_index += 1
+                if hop_index * self.hop_length < self.n_fft:
+                    continue
+                if perf_counter_ns() - received_ns > self._latency_budget_ns:
+                    self.stats.dropped_frames += 1
+                    continue
+                window = self._ring.window()
+                if self._is_silent(window):
+                    self.stats.silent_frames += 1
+                    continue
+                peaks = self.frame_peaks(window)
+                self.stats.add(perf_counter_ns() - received_ns)
+                yield hop_index * self.hop_duration, peaks
+        reader.join()
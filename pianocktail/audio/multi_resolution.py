@@ -0,0 +1,133 @@
+import logging
+import math
+from dataclasses import dataclass
+from functools import cached_property
+
+import torch
+import torch.nn.functional as ff
+import torchaudio.transforms  # type: ignore
+
+from .audio_clip import FILTER_MARGIN, AudioClip, filter_spectogram
+
+# Fraction of the Nyquist frequency of a decimated signal that a band may use,
+# the remaining part is the transition band of the resampling filter.
+NYQUIST_MARGIN = 0.8
+
+
+@dataclass(frozen=True)
+class BandTransform:
+    low: float
+    high: float
+    decimation: int
+    sample_rate: float
+    n_fft: int
+    scale: float
+
+    @property
+    def resolution(self) -> float:
+        return self.sample_rate / self.n_fft
+
+    @property
+    def bins(self) -> tuple[int, int]:
+        return int(self.low // self.resolution), int(self.high // self.resolution)
+
+
+class MultiResolutionAnalyzer:
+    """Band peaks of an AudioClip with a transform sized to each band.
+
+    The low bands are resolved finer than ``frequency_resolution``: the first band has
+    ``low_frequency_resolution``, and the resolution of the next ones grows with their
+    lower bound (constant Q) up to ``frequency_resolution``. Each band is analysed on
+    the signal decimated by the largest power of two that keeps its upper bound, with
+    a FFT just large enough for its resolution, and only its own frequency rows are
+    filtered. Consecutive bands with the same decimation and FFT size share it.
+
+    A single STFT resolving the first band as finely would need ``frequency_resolution
+    / low_frequency_resolution`` times more bins on every frame.
+
+    The frames are aligned on the ones of ``AudioClip.spectogram`` and the power is
+    scaled to its FFT size, so that ``peaks`` has the same layout and magnitudes as
+    ``AudioClip.peaks``, at the resolution of each band.
+    """
+
+    logger = logging.getLogger("pianocktail.audio.multi_resolution.MultiResolutionAnalyzer")
+
+    def __init__(self, clip: AudioClip) -> None:
+        self.clip = clip
+        self.sampling = clip.config.sampling
+
+    @cached_property
+    def bands(self) -> list[BandTransform]:
+        sample_rate = self.clip.metadata.sample_rate
+        window_length = self.sampling.duration * sample_rate
+        frequencies = self.sampling.frequency_range
+        bands = []
+        for low, high in zip(frequencies[:-1], frequencies[1:]):
+            decimation = 0
+            while sample_rate / 2 ** (decimation + 2) * NYQUIST_MARGIN >= high:
+                decimation += 1
+            band_sample_rate = sample_rate / 2**decimation
+            resolution = min(self.sampling.frequency_resolution, self.sampling.low_frequency_resolution * low / frequencies[0])
+            n_fft = 2 * math.ceil(band_sample_rate / resolution / 2)
+            if n_fft >= window_length / 2**decimation:
+                self.logger.error("Resolution %f of band %f-%f is too fine for the sample duration", resolution, low, high)
+                raise ValueError(f"Resolution {resolution}Hz of band {low}-{high}Hz needs more than {self.sampling.duration}s of signal")
+            bands.append(BandTransform(low, high, decimation, band_sample_rate, n_fft, (self.clip.n_fft / n_fft) ** 2))
+        self.logger.debug("Bands: %s", bands)
+        return bands
+
+    @cached_property
+    def _transforms(self) -> list[list[BandTransform]]:
+        """Runs of consecutive bands with the same decimation and FFT size."""
+        transforms: list[list[BandTransform]] = []
+        for band in self.bands:
+            if transforms and (transforms[-1][0].decimation, transforms[-1][0].n_fft) == (band.decimation, band.n_fft):
+                transforms[-1].append(band)
+            else:
+                transforms.append([band])
+        return transforms
+
+    @cached_property
+    def _windows(self) -> dict[int, torch.Tensor]:
+        return {band.n_fft: torch.hann_window(band.n_fft) for band in self.bands}
+
+    @cached_property
+    def Decimation_opj(self) -> torchaudio.transforms.Resample:
+        return torchaudio.transforms.Resample(orig_freq=2, new_freq=1)
+
+    def _decimated(self, waveform: torch.Tensor) -> list[torch.Tensor]:
+        """The waveform decimated by 1, 2, 4, ... up to the largest decimation of the bands."""
+        levels = [waveform]
+        for _ in range(max(band.decimation for band in self.bands)):
+            levels.append(self.Decimation_opj(levels[-1]))
+        return levels
+
+    def _n_frames(self, waveform: torch.Tensor) -> int:
+        return 1 + waveform.shape[0] // self.clip.hop_length
+
+    def _band_spectogram(self, band: BandTransform, waveform: torch.Tensor, n_frames: int, rows: slice = slice(None)) -> torch.Tensor:
+        # Frames centered on the ones of the reference spectogram, as with center=True.
+        padded = ff.pad(waveform.reshape(1, 1, -1), (band.n_fft // 2, band.n_fft // 2), mode="reflect")[0, 0]
+        positions = torch.round(torch.arange(n_frames) * self.clip.hop_length / 2**band.decimation).long()
+        positions = positions.clamp(max=padded.shape[0] - band.n_fft)
+        frames = padded[positions.unsqueeze(1) + torch.arange(band.n_fft)] * self._windows[band.n_fft]
+        return torch.fft.rfft(frames)[:, rows].abs().pow(2).T * band.scale
+
+    def peaks(self, start: float) -> list[dict[torch.Tensor, torch.Tensor]]:
+        return self.waveform_peaks(self.clip.sample(start)[0])
+
+    def waveform_peaks(self, waveform: torch.Tensor) -> list[dict[torch.Tensor, torch.Tensor]]:
+        n_frames = self._n_frames(waveform)
+        levels = self._decimated(waveform)
+        peaks: list[dict[torch.Tensor, torch.Tensor]] = [{} for _ in range(n_frames)]
+        for bands in self._transforms:
+            # Only the rows of the bands are filtered, with the ones the kernels reach them from.
+            first = max(0, bands[0].bins[0] - FILTER_MARGIN)
+            rows = slice(first, bands[-1].bins[1] + FILTER_MARGIN)
+            filtered = filter_spectogram(self._band_spectogram(bands[0], levels[bands[0].decimation], n_frames, rows))
+            for band in bands:
+                low_bin, high_bin = band.bins
+                result = torch.max(filtered[low_bin - first : high_bin - first, :], dim=0)
+                for iter, (indice, value) in enumerate(zip(result.indices, result.values)):
+                    peaks[iter][(low_bin + indice) * band.resolution] = value
+        return peaks
@@ -0,0 +1,101 @@
+import logging
+import os
+import typing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+
+import torch
+import torch.nn.functional as ff
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from pianocktail.config import Config
+
+from .audio_clip import AudioClip, filter_spectogram
+
+module_logger = logging.getLogger("pianocktail.audio.plotting")
+
+DPI = 100
+
+
+@dataclass(frozen=True)
+class PlotSize:
+    width: int = 1200
+    height: int = 400
+
+
+def decimate_waveform(waveform: torch.Tensor, width: int) -> tuple[torch.Tensor, torch.Tensor]:
+    """Minimum and maximum envelopes of a 1D waveform, one value per pixel column."""
+    if waveform.shape[0] <= width:
+        return waveform, waveform
+    signal = waveform.reshape(1, 1, -1)
+    return -ff.adaptive_max_pool1d(-signal, width)[0, 0], ff.adaptive_max_pool1d(signal, width)[0, 0]
+
+
+def decimate_spectogram(spectogram: torch.Tensor, height: int, width: int) -> torch.Tensor:
+    """Max pooling of a (frequency, time) spectogram to at most one value per pixel, so that the peaks stay visible."""
+    size = (min(height, spectogram.shape[0]), min(width, spectogram.shape[1]))
+    return ff.adaptive_max_pool2d(spectogram.reshape(1, 1, *spectogram.shape), size)[0, 0]
+
+
+def _save(figure: Figure, path: str) -> None:
+    FigureCanvasAgg(figure)
+    figure.savefig(path, dpi=DPI)
+    figure.clear()
+
+
+def render_waveform(clip: AudioClip, waveform: torch.Tensor, path: str, size: PlotSize, title: str) -> None:
+    minimum, maximum = decimate_waveform(waveform[0], size.width)
+    duration = waveform.shape[1] / clip.metadata.sample_rate
+    figure = Figure(figsize=(size.width / DPI, size.height / DPI))
+    axes = figure.subplots()
+    axes.fill_between(torch.linspace(0, duration, minimum.shape[0]), minimum, maximum, linewidth=0.5)
+    axes.set_xlim(0, duration)
+    figure.suptitle(title)
+    _save(figure, path)
+
+
+def render_spectogram(clip: AudioClip, spectogram: torch.Tensor, path: str, size: PlotSize, title: str) -> None:
+    duration = spectogram.shape[1] / (clip.metadata.sample_rate / clip.hop_length)
+    spectogram = 20 * torch.log10(decimate_spectogram(spectogram, size.height, size.width) + 1e-12)
+    figure = Figure(figsize=(size.width / DPI, size.height / DPI))
+    axes = figure.subplots()
+    axes.imshow(
+        spectogram,
+        cmap="viridis",
+        origin="lower",
+        aspect="auto",
+        extent=(0, duration, 0, clip.freq_max),
+        interpolation="nearest",
+    )
+    figure.suptitle(title)
+    _save(figure, path)
+
+
+def render_clip(name: str, config: Config, start: float, output_dir: str, size: PlotSize) -> list[str]:
+    """Write the waveform, spectogram and filtered spectogram PNGs of a window of a clip."""
+    clip = AudioClip(name, config, torch.device("cpu"))
+    prefix = os.path.join(output_dir, name.replace(os.sep, "__"))
+    waveform = clip.sample(start)
+    spectogram = clip.Spectogram_opj(waveform)[0, :, :]
+    paths = [f"{prefix}_waveform.png", f"{prefix}_spectogram.png", f"{prefix}_filtered.png"]
+    render_waveform(clip, waveform, paths[0], size, f"Raw waveform: {name}")
+    render_spectogram(clip, spectogram, paths[1], size, f"Raw spectogram: {name}")
+    render_spectogram(clip, filter_spectogram(spectogram), paths[2], size, f"Filtered spectogram: {name}")
+    return paths
+
+
+def render_clips(names: typing.Sequence[str], config: Config, start: float, output_dir: str, size: PlotSize, jobs: int) -> int:
+    """Render the clips in ``jobs`` processes with the Agg backend, return the number of failures."""
+    os.makedirs(output_dir, exist_ok=True)
+    failures = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(render_clip, name, config, start, output_dir, size): name for name in names}
+        for future in as_completed(futures):
+            try:
+                module_logger.debug(f"{futures[future]} rendered to {', '.join(future.result())}")
+            except (ValueError, RuntimeError) as e:
+                module_logger.error(f"Unable to render {futures[future]}: {e}")
+                failures += 1
+    module_logger.info(f"{len(names) - failures} clips rendered to {output_dir}")
+    return failures
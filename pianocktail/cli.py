@@ -1,4 +1,5 @@
 import logging
+import sys
 import typing
 from contextlib import contextmanager
 from dataclasses import dataclass
@@ -11,11 +12,16 @@ from matplotlib import pyplot
 from peewee import SqliteDatabase
 from peewee_migrate import Router
 
+from .analysis import BatchAnalysis
 from .audio.audio_clip import AudioClip
+from .audio.live import LiveAnalyzer
+from .audio.multi_resolution import MultiResolutionAnalyzer
 from .config import Config, load_config
 from .dataset import models
+from .dataset.audio_catalog import pending_analysis, readable_entries, scan_audio_location
 from .utils.logging import logger_config
 from .dataset.raw_dataset import load_dataset
+from .dataset.snapshot import export_snapshot
 
 DOC_TEMPLATE = """{program}
 
@@ -82,11 +88,14 @@ def clocking(is_clocking: bool) -> typing.Generator[None, None, None]:
 
 @dsc.command()  # type: ignore
 def single(precommand_args: dict[str, typing.Any], args: dict[str, typing.Any]) -> None:
-    """usage: {program} single <sound> [--display]
+    """usage: {program} single <sound> [--display] [--multi_resolution]
 
     Analysis of a single sample.
     Used for program teakwing.
 
+    options:
+        --multi_resolution  Extract the peaks with a transform sized to each band
+
     """
     with precommand_config(precommand_args=precommand_args) as precommand:
         main_logger.info("Extracting sample")
@@ -104,7 +113,7 @@ def single(precommand_args: dict[str, typing.Any], args: dict[str, typing.Any])
 
         main_logger.info("Get peaks")
         with clocking(precommand.clocking):
-            peaks = clip.peaks(0)
+            peaks = MultiResolutionAnalyzer(clip).peaks(0) if args["--multi_resolution"] else clip.peaks(0)
         p_spectogram = clip.peaks_to_spectogram(peaks, spectogram.shape)
 
         clip.write_spectogram_to_audio(spectogram, f"raw_{args['<sound>']}")
@@ -118,6 +127,115 @@ def single(precommand_args: dict[str, typing.Any], args: dict[str, typing.Any])
             clip.plot_spectogram(filtered_spectogram, "Filtered spectogram")
             clip.plot_spectogram(p_spectogram, "peaks")
             pyplot.show()
+            pyplot.close("all")
+
+
+@dsc.command()  # type: ignore
+def plot(precommand_args: dict[str, typing.Any], args: dict[str, typing.Any]) -> None:
+    """usage: {program} plot [<sound> ...] [--output=<dir>] [--start=<seconds>] [--width=<px>] [--height=<px>] [--jobs=<n>]
+
+    Render the waveform and spectograms of a window of the sounds to PNG files, without display.
+    Without sounds, every file of the audio catalog is rendered.
+
+    options:
+        --output=<dir>       Output directory [default: plots]
+        --start=<seconds>    Start of the window [default: 0]
+        --width=<px>         Width of the images [default: 1200]
+        --height=<px>        Height of the images [default: 400]
+        --jobs=<n>           Number of rendering processes [default: 4]
+
+    """
+    with precommand_config(precommand_args=precommand_args) as precommand:
+        from .audio.plotting import PlotSize, render_clips
+
+        names = args["<sound>"] or [entry.path for entry in readable_entries()]
+        size = PlotSize(int(args["--width"]), int(args["--height"]))
+        with clocking(precommand.clocking):
+            render_clips(names, precommand.config, float(args["--start"]), args["--output"], size, int(args["--jobs"]))
+
+
+@dsc.command()  # type: ignore
+def live(precommand_args: dict[str, typing.Any], args: dict[str, typing.Any]) -> None:
+    """usage: {program} live [<pipe>] [--sample_rate=<rate>] [--channels=<n>] [--latency=<seconds>]
+
+    Real time analysis of raw PCM (signed 16 bits little endian) read from a named pipe, or stdin.
+    Defaults come from the live section of the configuration.
+
+    options:
+        --sample_rate=<rate>  Sample rate of the stream
+        --channels=<n>        Number of interleaved channels
+        --latency=<seconds>   Latency budget, older frames are dropped
+
+    """
+    with precommand_config(precommand_args=precommand_args) as precommand:
+        live_config = precommand.config.live
+        analyzer = LiveAnalyzer(
+            precommand.config,
+            int(args["--sample_rate"] or live_config.sample_rate),
+            int(args["--channels"] or live_config.channels),
+            float(args["--latency"] or live_config.latency_budget),
+            precommand.device,
+        )
+        main_logger.info("Live analysis, n_fft: %d, hop: %fs", analyzer.n_fft, analyzer.hop_duration)
+        stream = open(args["<pipe>"], "rb") if args["<pipe>"] else sys.stdin.buffer
+        try:
+            for time, peaks in analyzer.run(stream):
+                main_logger.info("%.2fs %s", time, " ".join(f"{float(f):.0f}Hz:{float(v):.3g}" for f, v in peaks.items()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stream.close()
+            main_logger.info("Live analysis: %s", analyzer.stats)
+
+
+@dsc.command()  # type: ignore
+def serve(precommand_args: dict[str, typing.Any], args: dict[str, typing.Any]) -> None:
+    """usage: {program} serve
+
+    Run the analysis and recommendation service on the host and port of the configuration.
+
+    """
+    with precommand_config(precommand_args=precommand_args) as precommand:
+        from pianocktail import service
+
+        main_logger.info("Serving on %s:%d", precommand.config.service.host, precommand.config.service.port)
+        service.serve(precommand.config, precommand.device)
+
+
+@dsc.command()  # type: ignore
+def scan(precommand_args: dict[str, typing.Any], args: dict[str, typing.Any]) -> None:
+    """usage: {program} scan
+
+    Update the audio catalog with the new, changed and removed files of the audio location.
+
+    """
+    with precommand_config(precommand_args=precommand_args) as precommand:
+        scan_audio_location(precommand.config, precommand.database)
+
+
+@dsc.command()  # type: ignore
+def batch(precommand_args: dict[str, typing.Any], args: dict[str, typing.Any]) -> None:
+    """usage: {program} batch [--all] [--no-scan] [--multi_resolution] [--pipelined] [--compact=<type> [--check_compact]]
+
+    Analyse the files of the audio catalog that are new or changed since their last analysis.
+
+    options:
+        --all               Analyse every file of the catalog
+        --no-scan           Do not scan the audio location before the analysis
+        --multi_resolution  Extract the peaks with a transform sized to each band
+        --pipelined         Read and decode the next windows in background threads during the analysis
+        --compact=<type>    Keep the spectograms as uint8 or float16 until the peak search
+        --check_compact     Check every compact spectogram against its float32 one, a file over the error bound fails
+
+    """
+    with precommand_config(precommand_args=precommand_args) as precommand:
+        if not args["--no-scan"]:
+            scan_audio_location(precommand.config, precommand.database)
+        entries = readable_entries() if args["--all"] else pending_analysis()
+        main_logger.info("%d files to analyse", len(entries))
+        with clocking(precommand.clocking):
+            analysis = BatchAnalysis(precommand.config, precommand.device, args["--multi_resolution"], args["--compact"], args["--check_compact"])
+            analysis.run(entries, args["--pipelined"])
 
 
 @dsc.command()  # type: ignore
@@ -135,22 +253,38 @@ def process_raw_dataset(precommand_args: dict[str, typing.Any], args: dict[str,
 
 
 @dsc.command()  # type: ignore
-def process_download(precommand_args: dict[str, typing.Any]) -> None:
-    """usage: {program} raw_dataset [--path=<path>]
+def process_download(precommand_args: dict[str, typing.Any], args: dict[str, typing.Any]) -> None:
+    """usage: {program} download [--manifest=<path>]
 
-    Process the raw dataset configuration.
+    Download the audio files listed in the manifest into the audio location.
+    Completed files are skipped and interrupted ones are resumed.
 
     options:
-        --path=<path>  Path to the dataset configuration [default: raw_dataset.yaml]
+        --manifest=<path>  Path to the download manifest, defaults to the one in the configuration
 
     """
     with precommand_config(precommand_args=precommand_args) as precommand:
         from pianocktail.downloader import Downloader
 
-        downloader = Downloader(precommand.config)
+        downloader = Downloader(precommand.config, args["--manifest"])
         downloader.download()
 
 
+@dsc.command()  # type: ignore
+def snapshot(precommand_args: dict[str, typing.Any], args: dict[str, typing.Any]) -> None:
+    """usage: {program} snapshot [--output=<path>]
+
+    Export the catalog, with its relations and ingredient lines, to a read-only memory mappable snapshot.
+
+    options:
+        --output=<path>  Path of the snapshot [default: pianocktail.snapshot]
+
+    """
+    with precommand_config(precommand_args=precommand_args) as precommand:
+        with clocking(precommand.clocking):
+            export_snapshot(args["--output"])
+
+
 @dsc.command()  # type: ignore
 def process_database(precommand_args: dict[str, typing.Any], args: dict[str, typing.Any]) -> None:
     """usage:
@@ -1,4 +1,6 @@
+import typing
 from dataclasses import dataclass
+
 import yaml
 
 
@@ -7,17 +9,66 @@ class SamplingConfig:
     duration: float
     frequency_resolution: float
     frequency_range: list[float]
+    # Windows whose loudest frame RMS is under this level, in dBFS, are skipped. None disables it.
+    silence_threshold: typing.Optional[float] = None
+    # Resolution, in Hz, of the first band in the multi-resolution analysis, the next bands
+    # scale it with their lower bound up to frequency_resolution.
+    low_frequency_resolution: float = 1.0
+
+
+@dataclass(frozen=True)
+class DownloadConfig:
+    manifest: str = "downloads.yaml"
+    base_url: typing.Optional[str] = None
+    concurrency: int = 8
+    chunk_size: int = 1 << 16
+    timeout: float = 300
+
+
+@dataclass(frozen=True)
+class LiveConfig:
+    sample_rate: int = 44100
+    channels: int = 2
+    latency_budget: float = 0.5
+
+
+@dataclass(frozen=True)
+class ServiceConfig:
+    host: str = "127.0.0.1"
+    port: int = 8642
+    max_batch_size: int = 32
+    max_batch_wait: float = 0.01
+
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    queue_depth: int = 4
+    workers: int = 2
 
 
 @dataclass(frozen=True)
 class Config:
     audio_location: str
     sampling: SamplingConfig
+    # Peaks of the batch analysis, one file per audio file of the catalog.
+    peaks_location: str = "peaks"
+    download: DownloadConfig = DownloadConfig()
+    live: LiveConfig = LiveConfig()
+    service: ServiceConfig = ServiceConfig()
+    pipeline: PipelineConfig = PipelineConfig()
 
 
 def load_config(path: str = "pianocktail.yaml") -> Config:
     with open(path, "r") as f:
         data = yaml.safe_load(f)
         data["sampling"] = SamplingConfig(**data["sampling"])
+        if "download" in data:
+            data["download"] = DownloadConfig(**data["download"])
+        if "live" in data:
+            data["live"] = LiveConfig(**data["live"])
+        if "service" in data:
+            data["service"] = ServiceConfig(**data["service"])
+        if "pipeline" in data:
+            data["pipeline"] = PipelineConfig(**data["pipeline"])
 
         return Config(**data)
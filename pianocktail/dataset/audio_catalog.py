@@ -0,0 +1,149 @@
+import logging
+import os
+import typing
+from dataclasses import dataclass, field
+
+import peewee
+import torch
+import torchaudio  # type: ignore
+
+from pianocktail.audio.audio_clip import AudioClip
+from pianocktail.config import Config
+from pianocktail.utils.files import file_sha256
+
+from .models.audio_file import AudioFile
+
+module_logger = logging.getLogger("pianocktail.dataset.audio_catalog")
+
+IGNORED_SUFFIXES = (".part", ".tmp", ".json")
+
+
+@dataclass
+class ScanReport:
+    added: list[str] = field(default_factory=list)
+    updated: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    unreadable: list[str] = field(default_factory=list)
+    unchanged: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{len(self.added)} added, {len(self.updated)} updated, {len(self.removed)} removed, "
+            f"{len(self.unreadable)} unreadable, {self.unchanged} unchanged"
+        )
+
+
+def iter_audio_location(audio_location: str) -> typing.Iterator[str]:
+    """Yield the path, relative to the audio location, of every candidate audio file."""
+    for root, directories, files in os.walk(audio_location):
+        directories[:] = [d for d in directories if not d.startswith(".")]
+        for filename in files:
+            if filename.startswith(".") or filename.endswith(IGNORED_SUFFIXES):
+                continue
+            yield os.path.relpath(os.path.join(root, filename), audio_location)
+
+
+def _probe(entry: AudioFile, full_path: str) -> None:
+    metadata = torchaudio.info(full_path)
+    entry.readable = True
+    entry.sample_rate = metadata.sample_rate
+    entry.num_channels = metadata.num_channels
+    entry.num_frames = metadata.num_frames
+    entry.bits_per_sample = metadata.bits_per_sample
+    entry.encoding = metadata.encoding
+
+
+def _mark_unreadable(entry: AudioFile) -> None:
+    entry.readable = False
+    entry.sample_rate = None
+    entry.num_channels = None
+    entry.num_frames = None
+    entry.bits_per_sample = 0
+    entry.encoding = "UNKNOWN"
+
+
+def scan_audio_location(config: Config, database: peewee.Database) -> ScanReport:
+    """Bring the audio catalog up to date with the content of the audio location.
+
+    Files whose size and modification time did not change are not opened. Changed
+    files are hashed, and only probed again when their content actually changed.
+    Files that are not readable audio are recorded as such, so that they are not
+    hashed and probed again by the next scans either.
+    """
+    report = ScanReport()
+    known = {entry.path: entry for entry in AudioFile.select()}
+    with database.atomic():
+        for path in iter_audio_location(config.audio_location):
+            full_path = os.path.join(config.audio_location, path)
+            stat = os.stat(full_path)
+            entry = known.pop(path, None)
+            if entry is not None and entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns:
+                report.unchanged += 1
+                continue
+
+            sha256 = file_sha256(full_path)
+            if entry is not None and entry.sha256 == sha256:
+                module_logger.debug(f"{path} touched but not modified")
+                entry.size = stat.st_size
+                entry.mtime_ns = stat.st_mtime_ns
+                entry.save()
+                report.unchanged += 1
+                continue
+
+            is_new = entry is None
+            if entry is None:
+                entry = AudioFile(path=path)
+            entry.size = stat.st_size
+            entry.mtime_ns = stat.st_mtime_ns
+            entry.sha256 = sha256
+            try:
+                _probe(entry, full_path)
+            except RuntimeError as e:
+                module_logger.warning(f"{path} is not a readable audio file: {e}")
+                _mark_unreadable(entry)
+                entry.save()
+                report.unreadable.append(path)
+                continue
+            entry.save()
+            (report.added if is_new else report.updated).append(path)
+            module_logger.debug(f"{path} {'added' if is_new else 'updated'}")
+
+        for path, entry in known.items():
+            module_logger.debug(f"{path} removed")
+            entry.delete_instance()
+            report.removed.append(path)
+
+    module_logger.info(f"Audio catalog scanned: {report}")
+    return report
+
+
+def readable_entries() -> list[AudioFile]:
+    return list(AudioFile.select().where(AudioFile.readable).order_by(AudioFile.path))
+
+
+def pending_analysis() -> list[AudioFile]:
+    """Readable catalog entries that are new or changed since their last analysis."""
+    query = AudioFile.select().where(
+        AudioFile.readable & (AudioFile.analyzed_sha256.is_null() | (AudioFile.analyzed_sha256 != AudioFile.sha256))
+    )
+    return list(query.order_by(AudioFile.path))
+
+
+def mark_analyzed(entry: AudioFile) -> None:
+    entry.analyzed_sha256 = entry.sha256
+    entry.save(only=[AudioFile.analyzed_sha256])
+
+
+def entry_metadata(entry: AudioFile) -> torchaudio.AudioMetaData:
+    return torchaudio.AudioMetaData(
+        sample_rate=entry.sample_rate,
+        num_frames=entry.num_frames,
+        num_channels=entry.num_channels,
+        bits_per_sample=entry.bits_per_sample,
+        encoding=entry.encoding,
+    )
+
+
+def clip_from_catalog(entry: AudioFile, config: Config, device: torch.device) -> AudioClip:
+    """Build an AudioClip using the catalog metadata instead of probing the file."""
+    return AudioClip(entry.path, config, device, metadata=entry_metadata(entry))
@@ -0,0 +1,23 @@
+from peewee import BigIntegerField, BooleanField, CharField, IntegerField
+from .base import BaseModel
+
+
+class AudioFile(BaseModel):
+    path = CharField(255, unique=True, index=True)
+    size = BigIntegerField()
+    mtime_ns = BigIntegerField()
+    sha256 = CharField(64)
+    # Files that are not readable audio are kept, without audio metadata, so that they are not probed again.
+    readable = BooleanField(default=True)
+    sample_rate = IntegerField(null=True)
+    num_channels = IntegerField(null=True)
+    num_frames = BigIntegerField(null=True)
+    bits_per_sample = IntegerField(default=0)
+    encoding = CharField(20, default="UNKNOWN")
+    analyzed_sha256 = CharField(64, null=True)
+
+    def __str__(self):
+        return f"{self.path}"
+
+    def __repr__(self):
+        return f"<AudioFile: {self.path} >"
@@ -0,0 +1,73 @@
+"""Peewee migrations -- 006_auto.py.
+
+Some examples (model - class or model name)::
+
+    > Model = migrator.orm['table_name']            # Return model in current state by name
+    > Model = migrator.ModelClass                   # Return model in current state by name
+
+    > migrator.sql(sql)                             # Run custom SQL
+    > migrator.run(func, *args, **kwargs)           # Run python function with the given args
+    > migrator.create_model(Model)                  # Create a model (could be used as decorator)
+    > migrator.remove_model(model, cascade=True)    # Remove a model
+    > migrator.add_fields(model, **fields)          # Add fields (allow_not_null=True skips default)
+    > migrator.change_fields(model, **fields)       # Change fields
+    > migrator.remove_fields(model, *field_names, cascade=True)
+    > migrator.rename_field(model, old_field_name, new_field_name)
+    > migrator.rename_table(model, new_table_name)
+    > migrator.add_index(model, *col_names, unique=False)
+    > migrator.add_not_null(model, *field_names)
+    > migrator.add_default(model, field_name, default)
+    > migrator.add_constraint(model, name, sql)
+    > migrator.drop_index(model, *col_names)
+    > migrator.drop_not_null(model, *field_names)
+    > migrator.drop_constraints(model, *constraints)
+
+"""
+
+from contextlib import suppress
+
+import peewee as pw
+from peewee_migrate import Migrator
+
+
+with suppress(ImportError):
+    import playhouse.postgres_ext as pw_pext
+
+
+def migrate(migrator: Migrator, database: pw.Database, *, fake=False):
+    """Write your migrations here."""
+    
+    migrator.add_fields(
+        'audiofile',
+
+        readable=pw.BooleanField(default=True))
+
+    migrator.change_fields('audiofile', sample_rate=pw.IntegerField(null=True))
+
+    migrator.drop_not_null('audiofile', 'sample_rate')
+
+    migrator.change_fields('audiofile', num_channels=pw.IntegerField(null=True))
+
+    migrator.drop_not_null('audiofile', 'num_channels')
+
+    migrator.change_fields('audiofile', num_frames=pw.BigIntegerField(null=True))
+
+    migrator.drop_not_null('audiofile', 'num_frames')
+
+
+def rollback(migrator: Migrator, database: pw.Database, *, fake=False):
+    """Write your rollback migrations here."""
+    
+    migrator.remove_fields('audiofile', 'readable')
+
+    migrator.change_fields('audiofile', sample_rate=pw.IntegerField())
+
+    migrator.add_not_null('audiofile', 'sample_rate')
+
+    migrator.change_fields('audiofile', num_channels=pw.IntegerField())
+
+    migrator.add_not_null('audiofile', 'num_channels')
+
+    migrator.change_fields('audiofile', num_frames=pw.BigIntegerField())
+
+    migrator.add_not_null('audiofile', 'num_frames')
@@ -0,0 +1,51 @@
+import logging
+import typing
+
+from .models.artist import Artist
+from .models.cocktail import Cocktail, Ingredient, IngredientLine, Unit
+from .models.genre import Genre
+from .models.song import Song
+
+module_logger = logging.getLogger("pianocktail.dataset.recommendation")
+
+
+def cocktail_description(cocktail: Cocktail) -> dict[str, typing.Any]:
+    lines = (
+        IngredientLine.select(IngredientLine, Ingredient, Unit)
+        .join(Ingredient)
+        .join(Unit)
+        .where(IngredientLine.cocktail == cocktail)
+        .order_by(Ingredient.name)
+    )
+    return {
+        "name": cocktail.name,
+        "ingredients": [{"name": line.ingredient.name, "quantity": line.quantity, "unit": line.ingredient.unit.name} for line in lines],
+    }
+
+
+def song_recommendations(name: str) -> list[dict[str, typing.Any]]:
+    """Cocktails of a song, then of its artist, then of the artist genres, without duplicates.
+
+    Raise KeyError if there is no song with this name.
+    """
+    song = Song.select(Song, Artist).join(Artist).where(Song.name == name).get_or_none()
+    if song is None:
+        module_logger.error(f"Song {name} not found")
+        raise KeyError(f"Song {name} not found")
+
+    recommendations: list[dict[str, typing.Any]] = []
+    seen: set[int] = set()
+    genre_cocktail = Genre.cocktails.get_through_model()
+    genre_ids = [genre.id for genre in song.artist.genres]
+    sources: list[tuple[str, typing.Iterable[Cocktail]]] = [
+        ("song", song.cocktails),
+        ("artist", song.artist.cocktails),
+        ("genre", Cocktail.select().join(genre_cocktail, on=(genre_cocktail.cocktail == Cocktail.id)).where(genre_cocktail.genre.in_(genre_ids))),
+    ]
+    for source, cocktails in sources:
+        for cocktail in cocktails:
+            if cocktail.id in seen:
+                continue
+            seen.add(cocktail.id)
+            recommendations.append({"source": source, **cocktail_description(cocktail)})
+    return recommendations
@@ -0,0 +1,289 @@
+"""Read-only binary snapshot of the catalog.
+
+The snapshot holds the songs, artists, genres, cocktails, ingredients and units with
+their relations resolved to array indices, so that worker processes can share a single
+page-cached file instead of querying the database.
+
+Layout, little endian::
+
+    header    magic (8 bytes), version (uint32), number of sections (uint32)
+    sections  name (32 bytes, utf-8, zero padded), offset (uint64), size (uint64), item format (8 bytes)
+    data      each section is an array aligned on 8 bytes
+
+Every table has ``<table>.ids`` (int64, ascending) and its names as ``<table>.names``
+(uint64 offsets, ``n + 1`` of them) and ``<table>.names.data`` (utf-8). A relation is
+stored in compressed sparse rows: ``<table>.<relation>`` (uint32 offsets, ``n + 1`` of
+them) and ``<table>.<relation>.indices`` (int32 indices in the target table). The
+ingredient lines are the ``cocktail.ingredients`` relation, with their quantities in
+``cocktail.ingredients.quantities`` (float64).
+"""
+
+import logging
+import mmap
+import os
+import struct
+import typing
+from bisect import bisect_left
+from fractions import Fraction
+
+from .models.artist import Artist
+from .models.cocktail import Cocktail, Ingredient, IngredientLine, Unit
+from .models.genre import Genre
+from .models.song import Song
+
+module_logger = logging.getLogger("pianocktail.dataset.snapshot")
+
+SNAPSHOT_MAGIC = b"PCKSNAP\0"
+SNAPSHOT_VERSION = 1
+HEADER = struct.Struct("<8sII")
+SECTION = struct.Struct("<32sQQ8s")
+ALIGNMENT = 8
+
+
+def _encode_names(names: typing.Sequence[str]) -> tuple[list[int], bytes]:
+    offsets = [0]
+    data = bytearray()
+    for name in names:
+        data.extend((name or "").encode())
+        offsets.append(len(data))
+    return offsets, bytes(data)
+
+
+def _quantity(quantity: typing.Any) -> float:
+    # Quantities are not always stored as integers, "3/4" for instance.
+    return float(Fraction(str(quantity)))
+
+
+def _csr(n_rows: int, pairs: typing.Iterable[tuple[typing.Any, ...]]) -> tuple[list[int], list[list[typing.Any]]]:
+    """Compressed sparse rows of ``(row, column, *values)`` pairs."""
+    rows: list[list[tuple[typing.Any, ...]]] = [[] for _ in range(n_rows)]
+    for row, *columns in pairs:
+        rows[row].append(tuple(columns))
+    offsets = [0]
+    entries: list[list[typing.Any]] = []
+    for row_columns in rows:
+        row_columns.sort()
+        entries.extend(list(column) for column in row_columns)
+        offsets.append(len(entries))
+    return offsets, [list(values) for values in zip(*entries)] if entries else []
+
+
+class SnapshotWriter:
+    def __init__(self) -> None:
+        self._sections: list[tuple[str, str, bytes]] = []
+
+    def add(self, name: str, item_format: str, values: typing.Sequence[typing.Union[int, float]]) -> None:
+        self._sections.append((name, item_format, struct.pack(f"<{len(values)}{item_format}", *values)))
+
+    def add_bytes(self, name: str, data: bytes) -> None:
+        self._sections.append((name, "B", data))
+
+    def add_table(self, table: str, ids: typing.Sequence[int], names: typing.Sequence[str]) -> None:
+        offsets, data = _encode_names(names)
+        self.add(f"{table}.ids", "q", ids)
+        self.add(f"{table}.names", "Q", offsets)
+        self.add_bytes(f"{table}.names.data", data)
+
+    def add_relation(self, table: str, relation: str, n_rows: int, pairs: typing.Iterable[tuple[int, int]]) -> None:
+        offsets, columns = _csr(n_rows, pairs)
+        self.add(f"{table}.{relation}", "I", offsets)
+        self.add(f"{table}.{relation}.indices", "i", columns[0] if columns else [])
+
+    def write(self, path: str) -> None:
+        data_offset = HEADER.size + SECTION.size * len(self._sections)
+        entries = []
+        for name, item_format, data in self._sections:
+            data_offset += -data_offset % ALIGNMENT
+            entries.append((name, item_format, data, data_offset))
+            data_offset += len(data)
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(entries)))
+            for name, item_format, data, offset in entries:
+                f.write(SECTION.pack(name.encode(), offset, len(data), item_format.encode()))
+            for _, _, data, offset in entries:
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(data)
+        os.replace(tmp_path, path)
+
+
+def export_snapshot(path: str) -> None:
+    """Write the whole catalog to a snapshot, with one query per table."""
+    tables: dict[str, list[typing.Any]] = {
+        "unit": list(Unit.select().order_by(Unit.id)),
+        "ingredient": list(Ingredient.select().order_by(Ingredient.id)),
+        "cocktail": list(Cocktail.select().order_by(Cocktail.id)),
+        "genre": list(Genre.select().order_by(Genre.id)),
+        "artist": list(Artist.select().order_by(Artist.id)),
+        "song": list(Song.select().order_by(Song.id)),
+    }
+    index = {table: {row.id: i for i, row in enumerate(rows)} for table, rows in tables.items()}
+
+    writer = SnapshotWriter()
+    for table, rows in tables.items():
+        writer.add_table(table, [row.id for row in rows], [row.name for row in rows])
+    writer.add("ingredient.unit", "i", [index["unit"][row.unit_id] for row in tables["ingredient"]])
+    writer.add("song.artist", "i", [index["artist"][row.artist_id] for row in tables["song"]])
+
+    relations = [
+        ("song", "cocktails", Song.cocktails.get_through_model(), "song", "cocktail"),
+        ("artist", "cocktails", Artist.cocktails.get_through_model(), "artist", "cocktail"),
+        ("artist", "genres", Artist.genres.get_through_model(), "artist", "genre"),
+        ("genre", "cocktails", Genre.cocktails.get_through_model(), "genre", "cocktail"),
+    ]
+    for table, relation, through, source, target in relations:
+        rows = through.select(getattr(through, source), getattr(through, target)).tuples()
+        pairs = [(index[table][source_id], index[target][target_id]) for source_id, target_id in rows]
+        writer.add_relation(table, relation, len(tables[table]), pairs)
+
+    lines = IngredientLine.select(IngredientLine.cocktail_id, IngredientLine.ingredient_id, IngredientLine.quantity).tuples()
+    offsets, columns = _csr(
+        len(tables["cocktail"]),
+        ((index["cocktail"][cocktail_id], index["ingredient"][ingredient_id], _quantity(quantity)) for cocktail_id, ingredient_id, quantity in lines),
+    )
+    writer.add("cocktail.ingredients", "I", offsets)
+    writer.add("cocktail.ingredients.indices", "i", columns[0] if columns else [])
+    writer.add("cocktail.ingredients.quantities", "d", columns[1] if columns else [])
+
+    writer.write(path)
+    module_logger.info(f"Snapshot written to {path}: " + ", ".join(f"{len(rows)} {table}s" for table, rows in tables.items()))
+
+
+class SnapshotTable:
+    """Ids and names of a table, indexed by position."""
+
+    def __init__(self, snapshot: "CatalogSnapshot", name: str) -> None:
+        self.name = name
+        self.ids = snapshot.array(f"{name}.ids")
+        self._name_offsets = snapshot.array(f"{name}.names")
+        self._names = snapshot.array(f"{name}.names.data")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def index(self, id: int) -> int:
+        position = bisect_left(self.ids, id)
+        if position == len(self.ids) or self.ids[position] != id:
+            raise KeyError(f"No {self.name} with id {id}")
+        return position
+
+    def name_at(self, position: int) -> str:
+        return str(self._names[self._name_offsets[position] : self._name_offsets[position + 1]], "utf-8")
+
+    def names(self) -> list[str]:
+        return [self.name_at(position) for position in range(len(self))]
+
+
+class SnapshotRelation:
+    """Adjacency lists of a relation, as views on the snapshot."""
+
+    def __init__(self, snapshot: "CatalogSnapshot", name: str) -> None:
+        self.offsets = snapshot.array(name)
+        self.indices = snapshot.array(f"{name}.indices")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position: int) -> memoryview:
+        return self.indices[self.offsets[position] : self.offsets[position + 1]]
+
+
+class CatalogSnapshot:
+    """Memory mapped catalog snapshot.
+
+    Arrays are memoryviews on the mapping: nothing is copied or decoded until accessed.
+    """
+
+    logger = logging.getLogger("pianocktail.dataset.snapshot.CatalogSnapshot")
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise self._invalid(f"{path} is empty, not a catalog snapshot")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+        self._arrays: dict[str, memoryview] = {}
+        try:
+            self._sections = self._read_sections(path)
+            self._open_tables()
+        except KeyError as e:
+            self.close()
+            raise self._invalid(f"{path} has no section {e}")
+        except ValueError:
+            self.close()
+            raise
+
+    def _open_tables(self) -> None:
+        self.units = SnapshotTable(self, "unit")
+        self.ingredients = SnapshotTable(self, "ingredient")
+        self.cocktails = SnapshotTable(self, "cocktail")
+        self.genres = SnapshotTable(self, "genre")
+        self.artists = SnapshotTable(self, "artist")
+        self.songs = SnapshotTable(self, "song")
+        self.ingredient_unit = self.array("ingredient.unit")
+        self.song_artist = self.array("song.artist")
+        self.song_cocktails = SnapshotRelation(self, "song.cocktails")
+        self.artist_cocktails = SnapshotRelation(self, "artist.cocktails")
+        self.artist_genres = SnapshotRelation(self, "artist.genres")
+        self.genre_cocktails = SnapshotRelation(self, "genre.cocktails")
+        self.cocktail_ingredients = SnapshotRelation(self, "cocktail.ingredients")
+        self.cocktail_quantities = self.array("cocktail.ingredients.quantities")
+
+    def _invalid(self, message: str) -> ValueError:
+        self.logger.error(message)
+        return ValueError(message)
+
+    def _read_sections(self, path: str) -> dict[str, tuple[int, int, str]]:
+        """The ``(offset, size, item format)`` of every section, raise ValueError if they do not fit the file."""
+        if len(self._buffer) < HEADER.size:
+            raise self._invalid(f"{path} is not a catalog snapshot")
+        magic, version, n_sections = HEADER.unpack_from(self._buffer)
+        if magic != SNAPSHOT_MAGIC:
+            raise self._invalid(f"{path} is not a catalog snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise self._invalid(f"{path} is a version {version} catalog snapshot, version {SNAPSHOT_VERSION} is expected")
+        if len(self._buffer) < HEADER.size + n_sections * SECTION.size:
+            raise self._invalid(f"{path} is truncated: its section table does not fit in the file")
+        sections: dict[str, tuple[int, int, str]] = {}
+        for i in range(n_sections):
+            raw_name, offset, size, raw_format = SECTION.unpack_from(self._buffer, HEADER.size + i * SECTION.size)
+            name, item_format = raw_name.rstrip(b"\0").decode(errors="replace"), raw_format.rstrip(b"\0").decode(errors="replace")
+            if offset + size > len(self._buffer):
+                raise self._invalid(f"{path} is truncated: section {name} ends after the end of the file")
+            try:
+                item_size = struct.calcsize(item_format)
+            except struct.error:
+                raise self._invalid(f"{path}: section {name} has an invalid item format {item_format!r}")
+            if size % item_size:
+                raise self._invalid(f"{path}: the size of section {name} is not a multiple of its item size")
+            sections[name] = (offset, size, item_format)
+        return sections
+
+    def array(self, name: str) -> memoryview:
+        if name not in self._arrays:
+            offset, size, item_format = self._sections[name]
+            self._arrays[name] = self._buffer[offset : offset + size].cast(item_format)  # type: ignore[call-overload]
+        return self._arrays[name]
+
+    def ingredient_lines(self, cocktail: int) -> list[tuple[int, float]]:
+        """``(ingredient, quantity)`` positions of a cocktail position."""
+        start, stop = self.cocktail_ingredients.offsets[cocktail], self.cocktail_ingredients.offsets[cocktail + 1]
+        return list(zip(self.cocktail_ingredients.indices[start:stop], self.cocktail_quantities[start:stop]))
+
+    def close(self) -> None:
+        for array in self._arrays.values():
+            array.release()
+        self._arrays.clear()
+        self._buffer.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Views handed out are still alive, the mapping is closed when they are collected.
+            self.logger.debug("Snapshot views still in use, the mapping stays open")
+
+    def __enter__(self) -> "CatalogSnapshot":
+        return self
+
+    def __exit__(self, *args: typing.Any) -> None:
+        self.close()
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import os
+import typing
+from dataclasses import asdict, dataclass
+from urllib.parse import urljoin
+
+import aiohttp
+import yaml
+
+from pianocktail.config import Config
+from pianocktail.utils.files import file_sha256
+
+STATE_FILENAME = ".download_state.json"
+# Completed downloads since the state file was last written, one JSON object per line.
+STATE_LOG_SUFFIX = ".log"
+PART_SUFFIX = ".part"
+
+
+@dataclass(frozen=True)
+class DownloadEntry:
+    name: str
+    url: str
+    sha256: typing.Optional[str] = None
+
+
+@dataclass
+class DownloadState:
+    url: str
+    size: int
+    sha256: str
+
+
+def load_manifest(path: str, base_url: typing.Optional[str] = None) -> list[DownloadEntry]:
+    """Read the download manifest.
+
+    The manifest maps a file name, relative to the audio location, to its url and
+    optional sha256 checksum::
+
+        files:
+          ace_of_spades.wav:
+            url: https://example.org/ace_of_spades.wav
+            sha256: 0123...
+    """
+    with open(path, "r") as f:
+        data = yaml.safe_load(f)
+    entries: list[DownloadEntry] = []
+    for name, entry in (data.get("files") or {}).items():
+        if isinstance(entry, str):
+            entry = {"url": entry}
+        url = urljoin(base_url, entry["url"]) if base_url else entry["url"]
+        sha256 = entry.get("sha256")
+        entries.append(DownloadEntry(name, url, sha256.lower() if sha256 else None))
+    return entries
+
+
+class Downloader:
+    """Fetch the audio files listed in the manifest into the audio location.
+
+    Transfers run concurrently on a single HTTP session, at most
+    ``config.download.concurrency`` at a time. Interrupted transfers are kept as
+    ``.part`` files and resumed with a Range request. Completed files are recorded
+    in a state file so that a rerun skips them without hashing them again: each
+    completion is appended to a log, merged into the state file at the end of the run.
+    File writes run in threads, off the event loop.
+    """
+
+    logger = logging.getLogger("pianocktail.downloader.Downloader")
+
+    def __init__(self, config: Config, manifest_path: typing.Optional[str] = None) -> None:
+        self.config = config
+        self._download_config = config.download
+        self._manifest_path = manifest_path or self._download_config.manifest
+        self._state_path = os.path.join(self.config.audio_location, STATE_FILENAME)
+        self._state_log_path = f"{self._state_path}{STATE_LOG_SUFFIX}"
+        self._state: dict[str, DownloadState] = {}
+        self._state_lock = asyncio.Lock()
+
+    def _load_state(self) -> dict[str, DownloadState]:
+        state: dict[str, DownloadState] = {}
+        if os.path.isfile(self._state_path):
+            with open(self._state_path, "r") as f:
+                state = {name: DownloadState(**entry) for name, entry in json.load(f).items()}
+        if os.path.isfile(self._state_log_path):
+            with open(self._state_log_path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line of an interrupted run.
+                        self.logger.debug("Ignoring incomplete state log line %r", line)
+                        continue
+                    name = record.pop("name")
+                    state[name] = DownloadState(**record)
+        return state
+
+    def _log_state(self, name: str, state: DownloadState) -> None:
+        with open(self._state_log_path, "a") as f:
+            f.write(json.dumps({"name": name, **asdict(state)}) + "\n")
+
+    def _save_state(self) -> None:
+        tmp_path = f"{self._state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({name: asdict(state) for name, state in self._state.items()}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._state_path)
+        if os.path.isfile(self._state_log_path):
+            os.remove(self._state_log_path)
+
+    def _path(self, entry: DownloadEntry) -> str:
+        return os.path.join(self.config.audio_location, entry.name)
+
+    def is_complete(self, entry: DownloadEntry) -> bool:
+        state = self._state.get(entry.name)
+        if state is None or state.url != entry.url:
+            return False
+        if entry.sha256 is not None and state.sha256 != entry.sha256:
+            return False
+        path = self._path(entry)
+        return os.path.isfile(path) and os.path.getsize(path) == state.size
+
+    def download(self) -> None:
+        asyncio.run(self.download_async())
+
+    async def download_async(self) -> None:
+        entries = load_manifest(self._manifest_path, self._download_config.base_url)
+        os.makedirs(self.config.audio_location, exist_ok=True)
+        self._state = self._load_state()
+        pending = [entry for entry in entries if not self.is_complete(entry)]
+        self.logger.info("%d files in manifest, %d already downloaded", len(entries), len(entries) - len(pending))
+        if not pending:
+            if os.path.isfile(self._state_log_path):
+                self._save_state()
+            return
+
+        semaphore = asyncio.Semaphore(self._download_config.concurrency)
+        connector = aiohttp.TCPConnector(limit=self._download_config.concurrency)
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=self._download_config.timeout)
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                results = await asyncio.gather(
+                    *(self._bounded_fetch(session, semaphore, entry) for entry in pending),
+                    return_exceptions=True,
+                )
+        finally:
+            await asyncio.to_thread(self._save_state)
+
+        failed: list[str] = []
+        for entry, result in zip(pending, results):
+            if isinstance(result, BaseException):
+                self.logger.error("Download of %s failed: %s", entry.name, result)
+                failed.append(entry.name)
+        if failed:
+            raise ValueError(f"{len(failed)} downloads failed: {', '.join(failed)}")
+
+    async def _bounded_fetch(self, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, entry: DownloadEntry) -> None:
+        async with semaphore:
+            await self._fetch(session, entry)
+
+    async def _fetch(self, session: aiohttp.ClientSession, entry: DownloadEntry) -> None:
+        path = self._path(entry)
+        part_path = f"{path}{PART_SUFFIX}"
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        async with session.get(entry.url, headers=headers) as response:
+            if response.status == 416 and offset:
+                self.logger.debug("%s: range not satisfiable, part file is already complete", entry.name)
+            else:
+                response.raise_for_status()
+                if offset and response.status != 206:
+                    self.logger.debug("%s: server ignored the range request, restarting", entry.name)
+                    offset = 0
+                elif offset:
+                    self.logger.debug("%s: resuming at byte %d", entry.name, offset)
+                with open(part_path, "ab" if offset else "wb") as f:
+                    async for chunk in response.content.iter_chunked(self._download_config.chunk_size):
+                        await asyncio.to_thread(f.write, chunk)
+
+        sha256 = await asyncio.to_thread(file_sha256, part_path)
+        if entry.sha256 is not None and sha256 != entry.sha256:
+            os.remove(part_path)
+            raise ValueError(f"Checksum mismatch for {entry.name}: expected {entry.sha256}, got {sha256}")
+        os.replace(part_path, path)
+        state = DownloadState(entry.url, os.path.getsize(path), sha256)
+        self._state[entry.name] = state
+        async with self._state_lock:
+            await asyncio.to_thread(self._log_state, entry.name, state)
+        self.logger.info("%s downloaded", entry.name)
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import math
+import typing
+from collections import OrderedDict
+from dataclasses import dataclass
+from time import perf_counter_ns
+
+import torch
+import torchaudio.transforms  # type: ignore
+from aiohttp import web
+
+from pianocktail.audio.audio_clip import AudioClip, band_peaks, filter_spectogram
+from pianocktail.config import Config
+from pianocktail.dataset.audio_catalog import clip_from_catalog
+from pianocktail.dataset.models.audio_file import AudioFile
+from pianocktail.dataset.recommendation import song_recommendations
+
+CLIP_CACHE_SIZE = 256
+
+
+@dataclass
+class AnalysisRequest:
+    path: str
+    start: float
+    future: "asyncio.Future[list[dict[torch.Tensor, torch.Tensor]]]"
+
+
+class AnalysisService:
+    """Long running analysis, keeping torch, the transforms and the database warm.
+
+    Concurrent analysis requests are queued and grouped in micro-batches: a batch is
+    run as soon as it holds ``max_batch_size`` requests or its first request waited
+    ``max_batch_wait`` seconds. The windows of a batch sharing a sample rate go through
+    a single spectogram, filter and peak pass.
+
+    Only the readable files of the audio catalog are analysed. A failing request only
+    fails its own future, or the ones of its group when the batched pass fails.
+    """
+
+    logger = logging.getLogger("pianocktail.service.AnalysisService")
+
+    def __init__(self, config: Config, device: torch.device) -> None:
+        self.config = config
+        self._device = device
+        self.max_batch_size = config.service.max_batch_size
+        self.max_batch_wait = config.service.max_batch_wait
+        self._clips: OrderedDict[str, AudioClip] = OrderedDict()
+        self._spectograms: dict[int, torchaudio.transforms.Spectrogram] = {}
+        self._queue: asyncio.Queue[AnalysisRequest] = asyncio.Queue()
+
+    def _clip(self, path: str) -> AudioClip:
+        clip = self._clips.get(path)
+        if clip is None:
+            entry = AudioFile.get_or_none((AudioFile.path == path) & AudioFile.readable)
+            if entry is None:
+                raise KeyError(f"{path} is not in the audio catalog")
+            clip = clip_from_catalog(entry, self.config, self._device)
+            self._clips[path] = clip
+            if len(self._clips) > CLIP_CACHE_SIZE:
+                self._clips.popitem(last=False)
+        else:
+            self._clips.move_to_end(path)
+        return clip
+
+    def _spectogram(self, n_fft: int) -> torchaudio.transforms.Spectrogram:
+        if n_fft not in self._spectograms:
+            self._spectograms[n_fft] = torchaudio.transforms.Spectrogram(n_fft=n_fft, power=2).to(self._device)
+        return self._spectograms[n_fft]
+
+    async def analyze(self, path: str, start: float) -> list[dict[torch.Tensor, torch.Tensor]]:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(AnalysisRequest(path, start, future))
+        return await future
+
+    async def run_batches(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            try:
+                deadline = asyncio.get_running_loop().time() + self.max_batch_wait
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - asyncio.get_running_loop().time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                await asyncio.to_thread(self._run_batch, batch)
+            except Exception as e:
+                # The batch task must outlive any failure, or every later request would wait forever.
+                self.logger.exception("Batch of %d requests failed", len(batch))
+                for request in batch:
+                    self._set(request.future, exception=e)
+
+    def _run_batch(self, batch: list[AnalysisRequest]) -> None:
+        start_ns = perf_counter_ns()
+        groups: dict[int, list[tuple[AnalysisRequest, torch.Tensor]]] = {}
+        for request in batch:
+            try:
+                clip = self._clip(request.path)
+                waveform = clip.sample(request.start)
+                groups.setdefault(clip.n_fft, []).append((request, waveform))
+            except Exception as e:
+                self.logger.debug("Unable to read %s at %s: %r", request.path, request.start, e)
+                self._resolve(request, exception=e)
+
+        for n_fft, items in groups.items():
+            try:
+                # Windows of a group have the same sample rate, hence the same length.
+                waveforms = torch.cat([waveform for _, waveform in items]).to(self._device)
+                spectograms = filter_spectogram(self._spectogram(n_fft)(waveforms))
+                for (request, _), spectogram in zip(items, spectograms):
+                    self._resolve(request, result=band_peaks(spectogram, self.config.sampling))
+            except Exception as e:
+                self.logger.error("Analysis of a group of %d windows failed: %r", len(items), e)
+                for request, _ in items:
+                    self._resolve(request, exception=e)
+        self.logger.debug("Batch of %d requests in %fms", len(batch), (perf_counter_ns() - start_ns) / 1e6)
+
+    @staticmethod
+    def _set(
+        future: "asyncio.Future[list[dict[torch.Tensor, torch.Tensor]]]",
+        result: typing.Optional[list[dict[torch.Tensor, torch.Tensor]]] = None,
+        exception: typing.Optional[BaseException] = None,
+    ) -> None:
+        # The future may already be resolved, or cancelled by a client that went away.
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)  # type: ignore
+
+    @classmethod
+    def _resolve(
+        cls,
+        request: AnalysisRequest,
+        result: typing.Optional[list[dict[torch.Tensor, torch.Tensor]]] = None,
+        exception: typing.Optional[BaseException] = None,
+    ) -> None:
+        """Resolve the future of a request from the batch thread."""
+        request.future.get_loop().call_soon_threadsafe(cls._set, request.future, result, exception)
+
+
+def _peaks_to_json(peaks: list[dict[torch.Tensor, torch.Tensor]]) -> list[list[tuple[float, float]]]:
+    return [[(float(frequency), float(value)) for frequency, value in frame.items()] for frame in peaks]
+
+
+async def _analysis_request(request: web.Request) -> tuple[str, float]:
+    """``(path, start)`` of an analysis request body, raise a 400 error if it is invalid."""
+    try:
+        data = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="The body is not valid JSON")
+    if not isinstance(data, dict) or not isinstance(data.get("path"), str):
+        raise web.HTTPBadRequest(text='The body must be an object with a "path" string')
+    try:
+        start = float(data.get("start", 0))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text='"start" must be a number')
+    if not math.isfinite(start) or start < 0:
+        raise web.HTTPBadRequest(text='"start" must be a finite, positive number of seconds')
+    return data["path"], start
+
+
+def make_app(service: AnalysisService) -> web.Application:
+    """HTTP interface of the service.
+
+    - ``POST /analyze`` with ``{"path": ..., "start": ...}`` returns the band peaks of the window,
+      ``path`` being the path of a file of the audio catalog.
+    - ``GET /recommend?song=<name>`` returns the cocktails of the song.
+    """
+
+    async def analyze(request: web.Request) -> web.Response:
+        path, start = await _analysis_request(request)
+        try:
+            peaks = await service.analyze(path, start)
+        except KeyError as e:
+            raise web.HTTPNotFound(text=str(e.args[0]))
+        except (ValueError, RuntimeError) as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return web.json_response({"peaks": _peaks_to_json(peaks)})
+
+    async def recommend(request: web.Request) -> web.Response:
+        song = request.query.get("song")
+        if not song:
+            raise web.HTTPBadRequest(text='The "song" query parameter is required')
+        try:
+            return web.json_response({"cocktails": song_recommendations(song)})
+        except KeyError as e:
+            raise web.HTTPNotFound(text=str(e.args[0]))
+
+    async def start_batches(app: web.Application) -> typing.AsyncIterator[None]:
+        task = asyncio.create_task(service.run_batches())
+        yield
+        task.cancel()
+
+    app = web.Application()
+    app.router.add_post("/analyze", analyze)
+    app.router.add_get("/recommend", recommend)
+    app.cleanup_ctx.append(start_batches)
+    return app
+
+
+def serve(config: Config, device: torch.device) -> None:
+    service = AnalysisService(config, device)
+    web.run_app(make_app(service), host=config.service.host, port=config.service.port, print=None)
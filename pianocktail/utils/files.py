@@ -0,0 +1,9 @@
+import hashlib
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            hash.update(chunk)
+    return hash.hexdigest()
@@ -0,0 +1,91 @@
+import logging
+import queue
+import threading
+import typing
+from dataclasses import dataclass
+from time import perf_counter_ns
+
+K = typing.TypeVar("K")
+T = typing.TypeVar("T")
+
+module_logger = logging.getLogger("pianocktail.utils.prefetch")
+
+# How often a blocked thread checks whether the pipeline was closed, in seconds.
+POLL_INTERVAL = 0.1
+
+
+@dataclass
+class PrefetchStats:
+    items: int = 0
+    # Time the loaders spent waiting for room in the queue: the compute side is the bottleneck.
+    io_stall_ns: int = 0
+    # Time the consumer spent waiting for a loaded item: the I/O side is the bottleneck.
+    compute_stall_ns: int = 0
+
+    def __str__(self) -> str:
+        return f"{self.items} items, I/O stall {self.io_stall_ns / 1e9:.3f}s, compute stall {self.compute_stall_ns / 1e9:.3f}s"
+
+
+class Prefetcher(typing.Generic[K, T]):
+    """Run blocking loaders in a few threads, ahead of the consumer.
+
+    Iterating yields ``(key, loaded)`` in completion order, while the threads load the
+    next tasks into a queue of at most ``depth`` items. An exception of a loader is
+    raised by the iteration.
+    """
+
+    def __init__(self, tasks: typing.Iterable[tuple[K, typing.Callable[[], T]]], depth: int, workers: int) -> None:
+        self._tasks = iter(tasks)
+        self._tasks_lock = threading.Lock()
+        self._queue: "queue.Queue[tuple[K, T, typing.Optional[BaseException]]]" = queue.Queue(maxsize=max(1, depth))
+        self._workers = max(1, workers)
+        self._closed = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.stats = PrefetchStats()
+
+    def _next_task(self) -> typing.Optional[tuple[K, typing.Callable[[], T]]]:
+        with self._tasks_lock:
+            return next(self._tasks, None)
+
+    def _put(self, item: tuple[K, typing.Any, typing.Optional[BaseException]]) -> None:
+        start = perf_counter_ns()
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        with self._stats_lock:
+            self.stats.io_stall_ns += perf_counter_ns() - start
+
+    def _work(self) -> None:
+        while not self._closed.is_set() and (task := self._next_task()) is not None:
+            key, load = task
+            try:
+                self._put((key, load(), None))
+            except Exception as e:
+                module_logger.debug(f"Loading of {key} failed: {e}")
+                self._put((key, None, e))
+                return
+
+    def __iter__(self) -> typing.Iterator[tuple[K, T]]:
+        threads = [threading.Thread(target=self._work, daemon=True) for _ in range(self._workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                start = perf_counter_ns()
+                while True:
+                    try:
+                        key, loaded, exception = self._queue.get(timeout=POLL_INTERVAL)
+                        break
+                    except queue.Empty:
+                        if not any(thread.is_alive() for thread in threads) and self._queue.empty():
+                            return
+                self.stats.compute_stall_ns += perf_counter_ns() - start
+                if exception is not None:
+                    raise exception
+                self.stats.items += 1
+                yield key, loaded
+        finally:
+            self._closed.set()